@@ -3,8 +3,11 @@
 Iqra AI - Gradio app with Transcribe, Iqra, Letter Practice tabs.
 """
 
+import asyncio
 import os
 import threading
+from concurrent.futures import ThreadPoolExecutor
+from html import escape
 
 import gradio as gr
 
@@ -14,14 +17,18 @@ from matcher import match_and_analyze, render_alignment_html
 from quran_data import get_verse, get_translation, list_chapters, load_quranenc_translation
 
 
+def _preload_translation(lang):
+    try:
+        load_quranenc_translation(lang)
+        print(f"Preloaded {lang} translations.")
+    except Exception as e:
+        print(f"Preload {lang} failed: {e}")
+
+
 def _preload_translations():
-    """Load all Surah/ayah for all Quran Enc languages in background."""
-    for lang in QURANENC_TRANSLATIONS:
-        try:
-            load_quranenc_translation(lang)
-            print(f"Preloaded {lang} translations.")
-        except Exception as e:
-            print(f"Preload {lang} failed: {e}")
+    """Load all Surah/ayah for all Quran Enc languages in background, one thread per language."""
+    with ThreadPoolExecutor(max_workers=len(QURANENC_TRANSLATIONS)) as ex:
+        list(ex.map(_preload_translation, QURANENC_TRANSLATIONS))
 
 # Translation display names
 TRANS_NAMES = {
@@ -32,6 +39,9 @@ TRANS_NAMES = {
     "swahili": "Swahili",
 }
 
+# Concurrent ASR requests per event; asr_engine coalesces them into batched pipe() calls
+ASR_CONCURRENCY = 8
+
 _hijaiyah_pipe = None
 
 
@@ -46,16 +56,16 @@ def _get_hijaiyah_pipe():
     return _hijaiyah_pipe
 
 
-def _transcribe_tab(audio, with_match, history):
+async def _transcribe_tab(audio, with_match, history):
     if audio is None:
         return "Please record or upload audio.", "", history or [], "No history yet"
     try:
-        result = asr_transcribe(audio, model_id=DEFAULT_ASR_MODEL)
+        result = await asyncio.to_thread(asr_transcribe, audio, model_id=DEFAULT_ASR_MODEL)
         text = result["text"]
         parts = [text]
         match_html = ""
         if with_match and text.strip():
-            analysis = match_and_analyze(text)
+            analysis = await asyncio.to_thread(match_and_analyze, text)
             if analysis["chapter_id"]:
                 parts.append(f"\n--- Match ---")
                 vid_end = analysis.get("verse_id_end", analysis["verse_id"])
@@ -72,20 +82,20 @@ def _transcribe_tab(audio, with_match, history):
         return f"Error: {e}", "", history or [], "No history yet"
 
 
-def _iqra_tab(audio, surah_num, ayah_num, trans_lang):
+async def _iqra_tab(audio, surah_num, ayah_num, trans_lang):
     if audio is None:
         return "", "", ""
     try:
-        result = asr_transcribe(audio, model_id=DEFAULT_ASR_MODEL)
+        result = await asyncio.to_thread(asr_transcribe, audio, model_id=DEFAULT_ASR_MODEL)
         text = result["text"]
-        analysis = match_and_analyze(text)
+        analysis = await asyncio.to_thread(match_and_analyze, text)
         html = render_alignment_html(analysis["word_alignment"]) if analysis["word_alignment"] else text
         trans = ""
         if trans_lang and trans_lang != "ar":
             cid = analysis.get("chapter_id")
             vid = analysis.get("verse_id")
             if cid and vid:
-                trans = get_translation(cid, vid, trans_lang)
+                trans = await asyncio.to_thread(get_translation, cid, vid, trans_lang)
         return text, html, trans
     except Exception as e:
         return f"Error: {e}", "", ""
@@ -102,28 +112,34 @@ def _iqra_verse(surah_num, ayah_num, trans_lang):
         if not verse:
             return "Verse not found.", ""
         trans = get_translation(cid, vid, trans_lang) if trans_lang and trans_lang != "ar" else ""
-        safe = verse.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        safe = escape(verse, quote=False)
         verse_html = f'<div dir="rtl" style="text-align: right; font-size: 1.2em;">{safe}</div>'
         return verse_html, trans
     except Exception as e:
         return f"Error: {e}", ""
 
 
-def _letter_practice(audio):
+async def _letter_practice(audio):
     if audio is None:
         return "Please record a short clip (one letter)."
     try:
-        pipe = _get_hijaiyah_pipe()
-        preds = pipe(audio, top_k=3)
+        pipe = await asyncio.to_thread(_get_hijaiyah_pipe)
+        preds = await asyncio.to_thread(pipe, audio, top_k=3)
         lines = [f"{p['label']}: {p['score']*100:.1f}%" for p in preds]
         return "\n".join(lines)
     except Exception as e:
         return f"Error: {e}"
 
 
-# Build UI
-chapters = list_chapters()
-surah_choices = [f"{c['id']}. {c['name']}" for c in chapters]
+def _surah_dropdown():
+    """Fill the Surah dropdown once the background XML load has finished."""
+    _chapters_thread.join()
+    return gr.update(choices=[str(c["id"]) for c in list_chapters()], value="1")
+
+
+# Build UI (chapter list loads in background; dropdown is filled on page load)
+_chapters_thread = threading.Thread(target=list_chapters, daemon=True)
+_chapters_thread.start()
 
 with gr.Blocks(title="Iqra AI") as app:
     gr.Markdown("# Iqra AI")
@@ -142,6 +158,7 @@ with gr.Blocks(title="Iqra AI") as app:
                 fn=_transcribe_tab,
                 inputs=[trans_audio, trans_match, trans_history_state],
                 outputs=[trans_out, trans_match_html, trans_history_state, trans_history_display],
+                concurrency_limit=ASR_CONCURRENCY,
             )
 
         with gr.TabItem("Iqra Mode"):
@@ -151,7 +168,7 @@ with gr.Blocks(title="Iqra AI") as app:
                 label="Translation language",
             )
             with gr.Row():
-                iqra_surah = gr.Dropdown(choices=[str(c["id"]) for c in chapters], value="1", label="Surah")
+                iqra_surah = gr.Dropdown(choices=["1"], value="1", label="Surah")
                 iqra_ayah = gr.Number(value=1, minimum=1, maximum=286, label="Ayah")
             iqra_verse_btn = gr.Button("Show verse")
             iqra_canon = gr.HTML(label="Canonical verse (Arabic, RTL)")
@@ -170,6 +187,7 @@ with gr.Blocks(title="Iqra AI") as app:
                 fn=_iqra_tab,
                 inputs=[iqra_audio, iqra_surah, iqra_ayah, trans_lang],
                 outputs=[iqra_recited, iqra_compare, iqra_trans_out],
+                concurrency_limit=ASR_CONCURRENCY,
             )
 
         with gr.TabItem("Letter Practice"):
@@ -178,6 +196,8 @@ with gr.Blocks(title="Iqra AI") as app:
             lp_btn = gr.Button("Classify")
             lp_btn.click(fn=_letter_practice, inputs=lp_audio, outputs=lp_out)
 
+    app.load(fn=_surah_dropdown, outputs=iqra_surah)
+
 # Preload all translations in background so every surah/ayah is available for all lang
 threading.Thread(target=_preload_translations, daemon=True).start()
 
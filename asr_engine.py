@@ -2,21 +2,46 @@
 ASR engine: uses Hugging Face pipeline for tarteel-ai/whisper-base-ar-quran.
 Matches Tarteel's official usage - pass file path directly to pipe(), no preprocessing.
 Uses repetition_penalty and no_repeat_ngram_size to suppress token repetition.
+Optional faster-whisper (CTranslate2) backend with IQRA_BACKEND=ct2.
 """
 
+import collections
+import contextlib
+import itertools
 import os
+import queue
 import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import numpy as np
 import soundfile as sf
 import torch
 from transformers import pipeline
+from transformers.pipelines.audio_utils import ffmpeg_read
 
-from config import DEFAULT_ASR_MODEL
+from config import ASR_BACKEND, CT2_MODEL_DIR, DEFAULT_ASR_MODEL, TORCH_COMPILE
 
 # Single pipeline instance (same as Tarteel demo)
 _pipe = None
 _pipe_model_id = None
+_ct2_model = None
+
+# Generation settings passed to every pipe() call (suppress token repetition)
+_GENERATE_KWARGS = {"repetition_penalty": 1.2, "no_repeat_ngram_size": 3}
+
+# Threads reading and decoding audio files for transcribe_batch (ffmpeg subprocess, releases the GIL)
+_READ_WORKERS = 8
+
+# Request coalescing: transcribe() calls arriving within the window share one batched pipe() call
+_COALESCE_WINDOW_S = 0.05
+_COALESCE_MAX = 8
+_request_q = queue.Queue()  # (model_id, path, Future)
+_worker = None
+_worker_lock = threading.Lock()
+_pipe_lock = threading.Lock()  # held whenever the HF pipeline runs
+_ct2_lock = threading.Lock()  # guards the lazy faster-whisper load
 
 
 def get_device():
@@ -44,20 +69,166 @@ def _get_pipe(model_id: str):
         token=token if token else None,
         device=get_device(),
     )
+    _pipe.model.eval()
+    _compile_encoder(_pipe.model)
     _pipe_model_id = model_id
     return _pipe
 
 
+def _compile_encoder(model):
+    """
+    torch.compile the Whisper encoder (opt-in, CUDA, PyTorch >= 2.1); the decoder stays eager.
+    Each input is a 30 s log-mel window but the batch size varies (1 to 8), so the default
+    mode is used: after a second shape dynamo recompiles once with a dynamic batch dimension.
+    "reduce-overhead" would capture a fresh CUDA graph for every batch size.
+    """
+    if not TORCH_COMPILE or get_device() != "cuda":
+        return
+    major, minor = (int(x) for x in torch.__version__.split(".")[:2])
+    if (major, minor) < (2, 1):
+        return
+    encoder = model.get_encoder()
+    encoder.forward = torch.compile(encoder.forward, fullgraph=False)
+
+
+def _get_ct2_model():
+    """Lazy load the CTranslate2 model (INT8 weights, FP16 compute on CUDA)."""
+    global _ct2_model
+    if _ct2_model is not None:
+        return _ct2_model
+    with _ct2_lock:  # concurrent first requests load the model once
+        if _ct2_model is None:
+            from faster_whisper import WhisperModel
+
+            # CTranslate2 has no MPS backend; Mac runs on CPU
+            device = "cuda" if get_device() == "cuda" else "cpu"
+            compute_type = "int8_float16" if device == "cuda" else "int8"
+            _ct2_model = WhisperModel(CT2_MODEL_DIR, device=device, compute_type=compute_type)
+    return _ct2_model
+
+
+def _ct2_transcribe(audio) -> dict:
+    """Transcribe a path or file-like object with faster-whisper; same dict shape as transcribe()."""
+    segments, _ = _get_ct2_model().transcribe(audio, language="ar", beam_size=1, **_GENERATE_KWARGS)
+    text = " ".join(seg.text.strip() for seg in segments).strip()
+    return {"text": text, "chunks": []}
+
+
+def _drain_requests() -> list:
+    """Block for one request, then collect more until the window closes or the batch is full."""
+    items = [_request_q.get()]
+    deadline = time.monotonic() + _COALESCE_WINDOW_S
+    while len(items) < _COALESCE_MAX:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            break
+        try:
+            items.append(_request_q.get(timeout=timeout))
+        except queue.Empty:
+            break
+    return items
+
+
+def _asr_worker():
+    """Background thread: run coalesced transcribe() requests as batched pipe() calls."""
+    while True:
+        items = _drain_requests()
+        for model_id in dict.fromkeys(m for m, _, _ in items):
+            group = [(path, fut) for m, path, fut in items if m == model_id]
+            try:
+                _run_group(model_id, group)
+            except Exception as e:  # never leave a caller waiting on a dead worker
+                for _, fut in group:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+
+def _run_group(model_id, group):
+    """
+    Run one model's requests as one batched pipe() call. Files are decoded first:
+    clips over one 30 s window cannot share a batch (variable-length features), so
+    they run alone. If the batch itself fails, each file is re-run alone, so a
+    broken upload only fails its own request.
+    """
+    try:
+        with _pipe_lock:
+            pipe = _get_pipe(model_id)
+    except Exception as e:  # model load failed: no request can run
+        for _, fut in group:
+            fut.set_exception(e)
+        return
+    sampling_rate, max_samples = pipe.feature_extractor.sampling_rate, _window_samples(pipe)
+    short, long = [], []
+    for path, fut in group:
+        try:
+            audio = _load_audio(path, sampling_rate)
+        except (OSError, ValueError) as e:  # unreadable, or ffmpeg could not decode it
+            fut.set_exception(e)
+            continue
+        (short if len(audio) <= max_samples else long).append((audio, fut))
+    if len(short) > 1:
+        try:
+            with _pipe_lock, _inference():
+                outs = list(
+                    pipe(
+                        [audio for audio, _ in short],
+                        batch_size=len(short),
+                        return_timestamps=False,
+                        **_GENERATE_KWARGS,
+                    )
+                )
+        except Exception:
+            outs = None  # re-run each below
+        if outs is not None:
+            for (_, fut), out in zip(short, outs):
+                fut.set_result(out)
+            short = []
+    # A lone short clip, long clips, or the files of a failed batch: one pipe() call each
+    for audio, fut in short + long:
+        try:
+            with _pipe_lock, _inference():
+                out = _transcribe_array(pipe, audio)
+        except Exception as e:
+            fut.set_exception(e)
+            continue
+        fut.set_result(out)
+
+
+def _submit(model_id, path) -> Future:
+    """Queue one file for the ASR worker, starting it on first use."""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_asr_worker, daemon=True)
+            _worker.start()
+    fut = Future()
+    _request_q.put((model_id, path, fut))
+    return fut
+
+
+@contextlib.contextmanager
+def _inference():
+    """No autograd bookkeeping; mixed precision on CUDA (BF16 where supported, else FP16)."""
+    with torch.inference_mode():
+        if get_device() != "cuda":
+            yield
+            return
+        dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        with torch.autocast(device_type="cuda", dtype=dtype):
+            yield
+
+
 def transcribe(audio_path, model_id=None, return_timestamps=False):
     """
     Transcribe audio using the ASR pipeline (Tarteel exact usage).
     Pass file path directly to pipe() - no preprocessing.
     Uses repetition_penalty and no_repeat_ngram_size to suppress hallucinations.
+    Concurrent calls are coalesced into one batched pipe() call by a worker thread.
+    With IQRA_BACKEND=ct2, runs the faster-whisper model from CT2_MODEL_DIR instead.
     Returns {"text": str, "chunks": []}.
     """
     if model_id is None:
         model_id = DEFAULT_ASR_MODEL
-    pipe = _get_pipe(model_id)
 
     # Guard: if Gradio passes tuple (sample_rate, array), save to temp file
     path_to_use = audio_path
@@ -71,12 +242,9 @@ def transcribe(audio_path, model_id=None, return_timestamps=False):
             tmp_created = True
 
     try:
-        out = pipe(
-            path_to_use,
-            return_timestamps=False,
-            repetition_penalty=1.2,
-            no_repeat_ngram_size=3,
-        )
+        if ASR_BACKEND == "ct2":
+            return _ct2_transcribe(path_to_use)
+        out = _submit(model_id, path_to_use).result()
         text = (out.get("text") or "").strip()
         return {"text": text, "chunks": []}
     finally:
@@ -85,3 +253,164 @@ def transcribe(audio_path, model_id=None, return_timestamps=False):
                 os.unlink(path_to_use)
             except OSError:
                 pass
+
+
+def _load_audio(path, sampling_rate: int) -> np.ndarray:
+    """Read and decode an audio file to mono float32 at sampling_rate, as pipe() does for bytes."""
+    with open(path, "rb") as f:
+        return ffmpeg_read(f.read(), sampling_rate)
+
+
+def _duration(path) -> float:
+    """
+    Audio length in seconds from the file header alone; unknown formats give inf.
+    Raises OSError if the file cannot be opened.
+    """
+    os.stat(path)
+    try:
+        return sf.info(path).duration
+    except RuntimeError:
+        return float("inf")
+
+
+def _window_samples(pipe) -> int:
+    """
+    Samples in one Whisper input window (30 s). Longer clips get variable-length features
+    (no truncation), which the pipeline cannot collate into a batch with other clips.
+    """
+    fe = pipe.feature_extractor
+    return getattr(fe, "n_samples", 30 * fe.sampling_rate)
+
+
+def _transcribe_array(pipe, audio):
+    """One decoded clip through the HF pipeline (or faster-whisper when pipe is None)."""
+    if pipe is None:
+        return _ct2_transcribe(audio)
+    return pipe(audio, return_timestamps=False, **_GENERATE_KWARGS)
+
+
+def _prefetch(paths, sampling_rate, ahead):
+    """
+    Yield each file's decoded audio in order, loading up to `ahead` files in the background.
+    A file that cannot be read or decoded yields its exception instead.
+    """
+    with ThreadPoolExecutor(max_workers=_READ_WORKERS) as ex:
+        it = iter(paths)
+        window = collections.deque(ex.submit(_load_audio, p, sampling_rate) for p in itertools.islice(it, ahead))
+        while window:
+            try:
+                audio = window.popleft().result()
+            except (OSError, ValueError) as e:  # unreadable, or ffmpeg could not decode it
+                audio = e
+            for p in itertools.islice(it, 1):
+                window.append(ex.submit(_load_audio, p, sampling_rate))
+            yield audio
+
+
+def transcribe_batch(audio_paths, model_id=None, batch_size=8):
+    """
+    Transcribe several audio files with batched forward passes.
+    Headers are probed concurrently and clips of at most one 30 s window are fed
+    shortest first, so each batch holds clips of similar length; the feature
+    extractor pads each one to the full window and the batch runs through the
+    model at once, instead of one pipe() call per file.
+    Files are read and decoded ahead of the model on a thread pool, overlapping
+    I/O with inference, and results stream out as each batch finishes.
+    Longer clips (or unknown durations) run alone after the batches; if a batch
+    fails, its files are re-run alone so one bad file cannot abort the rest.
+    Yields {"path": str, "text": str, "chunks": []} in completion order (shortest
+    first, not input order); files that cannot be opened, read or decoded yield an
+    empty text plus an "error" message.
+    """
+    if model_id is None:
+        model_id = DEFAULT_ASR_MODEL
+    paths = list(audio_paths)
+    if not paths:
+        return
+    durations = [None] * len(paths)
+    errors = [None] * len(paths)
+    with ThreadPoolExecutor(max_workers=_READ_WORKERS) as ex:
+        futures = [ex.submit(_duration, p) for p in paths]
+        for i, fut in enumerate(futures):
+            try:
+                durations[i] = fut.result()
+            except OSError as e:
+                errors[i] = str(e)
+    for path, error in zip(paths, errors):
+        if error is not None:
+            yield {"path": path, "text": "", "chunks": [], "error": error}
+    order = sorted((i for i, e in enumerate(errors) if e is None), key=durations.__getitem__)
+    if not order:
+        return
+    if ASR_BACKEND == "ct2":
+        pipe = None
+        sampling_rate = 16000  # faster-whisper takes 16 kHz arrays
+        max_samples = float("inf")  # faster-whisper windows long audio itself
+    else:
+        with _pipe_lock:
+            pipe = _get_pipe(model_id)
+        sampling_rate = pipe.feature_extractor.sampling_rate
+        max_samples = _window_samples(pipe)
+    fed = collections.deque()  # (index, audio) handed to the batched model, not yet answered
+    failed = collections.deque()  # (index, message) for files that failed to load
+    long = []  # (index, audio) decoded longer than the header said: run alone too
+
+    # Only clips whose header says they fit one window are batched; the rest run alone at the end,
+    # decoded one at a time. Unknown durations (inf) count as long.
+    window_s = max_samples / sampling_rate
+    batched = [i for i in order if durations[i] <= window_s]
+    alone = [i for i in order if durations[i] > window_s]
+
+    def inputs():
+        for i, audio in zip(batched, _prefetch([paths[i] for i in batched], sampling_rate, 2 * batch_size)):
+            if isinstance(audio, Exception):
+                failed.append((i, str(audio)))
+            elif len(audio) > max_samples:
+                long.append((i, audio))
+            else:
+                fed.append((i, audio))
+                yield audio
+
+    def result(i, out):
+        return {"path": paths[i], "text": (out.get("text") or "").strip(), "chunks": []}
+
+    def run_alone(i, audio):
+        try:
+            with _pipe_lock, _inference():
+                return result(i, _transcribe_array(pipe, audio))
+        except Exception as e:
+            return {"path": paths[i], "text": "", "chunks": [], "error": str(e)}
+
+    source = inputs()
+    outs = None
+    while True:
+        if outs is None:
+            if ASR_BACKEND == "ct2":
+                outs = (_ct2_transcribe(audio) for audio in source)
+            else:
+                # Generator input: pipe() returns a lazy iterator instead of a finished list
+                outs = pipe(source, batch_size=batch_size, return_timestamps=False, **_GENERATE_KWARGS)
+        try:
+            with _pipe_lock, _inference():
+                out = next(outs, None)
+        except Exception:
+            # A batch failed: re-run its files alone so only a broken one errors, then resume
+            stranded = list(fed)
+            fed.clear()
+            outs = None
+            for i, audio in stranded:
+                yield run_alone(i, audio)
+            continue
+        while failed:
+            i, error = failed.popleft()
+            yield {"path": paths[i], "text": "", "chunks": [], "error": error}
+        if out is None:
+            break
+        yield result(fed.popleft()[0], out)
+    for i, audio in long:
+        yield run_alone(i, audio)
+    for i, audio in zip(alone, _prefetch([paths[i] for i in alone], sampling_rate, 1)):
+        if isinstance(audio, Exception):
+            yield {"path": paths[i], "text": "", "chunks": [], "error": str(audio)}
+        else:
+            yield run_alone(i, audio)
@@ -6,6 +6,10 @@ import os
 
 # ASR model (Tarteel only)
 DEFAULT_ASR_MODEL = "tarteel-ai/whisper-base-ar-quran"
+# ASR backend: "hf" (transformers pipeline) or "ct2" (faster-whisper / CTranslate2, see README)
+ASR_BACKEND = os.environ.get("IQRA_BACKEND", "hf")
+# torch.compile the Whisper encoder on CUDA (PyTorch >= 2.1); opt-in with IQRA_TORCH_COMPILE=1
+TORCH_COMPILE = os.environ.get("IQRA_TORCH_COMPILE", "0") == "1"
 
 # Tanzil XML (ceefour / qurandatabase) - Arabic only
 TANZIL_BASE = "https://raw.githubusercontent.com/ceefour/qurandatabase/master"
@@ -22,6 +26,9 @@ QURANENC_TRANSLATIONS = {
     "swahili": "swahili_rwwad",
 }
 
+# Quran Enc translations cached on disk (see QURANENC_DB_PATH); refetched after this many days
+QURANENC_CACHE_TTL_DAYS = 30
+
 # Full translation list: Arabic (Tanzil XML) + English/Somali/Amharic/Swahili (Quran Enc API)
 TRANSLATION_LANGS = ["ar", "en", "somali", "amharic", "swahili"]
 
@@ -29,3 +36,8 @@ TRANSLATION_LANGS = ["ar", "en", "somali", "amharic", "swahili"]
 PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(PROJECT_DIR, "data")
 ARABIC_XML_PATH = os.path.join(DATA_DIR, "Arabic-(Original-Book)-1.xml")
+QURAN_SNAPSHOT_PATH = os.path.join(DATA_DIR, "quran_text.pkl")
+VERSE_INDEX_PATH = os.path.join(DATA_DIR, "verse_index.pkl")
+QURANENC_DB_PATH = os.path.join(DATA_DIR, "quranenc.sqlite3")
+# Tarteel model converted with ct2-transformers-converter (IQRA_BACKEND=ct2)
+CT2_MODEL_DIR = os.environ.get("IQRA_CT2_MODEL_DIR") or os.path.join(DATA_DIR, "whisper-base-ar-quran-ct2")
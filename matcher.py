@@ -2,8 +2,24 @@
 Verse matching and mistake detection (Tarteel-style).
 """
 
+import os
+import pickle
+import sys
+from collections import Counter
 from difflib import SequenceMatcher
+from functools import lru_cache
+from html import escape
+from itertools import chain
 
+import numpy as np
+
+try:
+    from rapidfuzz import fuzz
+    from rapidfuzz.distance import Indel
+except ImportError:  # optional, falls back to difflib
+    fuzz = Indel = None
+
+from config import ARABIC_XML_PATH, VERSE_INDEX_PATH
 from quran_data import get_verse, list_chapters, normalize_arabic
 
 # Status: correct, missed (in canonical, not recited), incorrect, extra (recited, not in canonical)
@@ -12,10 +28,47 @@ STATUS_MISSED = "missed"
 STATUS_INCORRECT = "incorrect"
 STATUS_EXTRA = "extra"
 
+_STATUS_COLORS = {
+    STATUS_CORRECT: "#22c55e",   # green
+    STATUS_MISSED: "#ef4444",    # red
+    STATUS_INCORRECT: "#ef4444", # red
+    STATUS_EXTRA: "#f59e0b",     # amber
+}
+_SPAN = '<span style="color:{};font-weight:bold;">{}</span>'.format
+
+# Verse search: shortlist by TF-IDF cosine, then score 1–6 verse windows around each candidate
+SHORTLIST_SIZE = 20
+FALLBACK_RATIO = 0.6  # best shortlist score below this: scan every window instead
+MAX_WINDOW = 6
+_INDEX_VERSION = 4  # bump when the pickled index layout or normalization changes
+
+# --- Verse index (built once, persisted to VERSE_INDEX_PATH) ---
+_verse_keys = []   # position -> (chapter_id, verse_id)
+_norm_windows = {}  # (chapter_id, verse_id, k) -> normalized text of verses vid..vid+k
+_tfidf = {}        # sparse token x verse TF-IDF matrix in CSR form, see _build_tfidf
+
+
+def _ratio(a, b) -> float:
+    """Similarity in [0, 1]. RapidFuzz (C++) if installed, else difflib."""
+    if fuzz is not None:
+        return fuzz.ratio(a, b) / 100
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def _opcodes(a: list, b: list) -> list:
+    """
+    Edit opcodes (tag, i1, i2, j1, j2) turning a into b. RapidFuzz Indel (LCS, so as many
+    words as possible stay "equal", like difflib) if installed, else difflib.
+    Indel never emits "replace": a substitution comes out as insert + delete.
+    """
+    if Indel is not None:
+        return Indel.opcodes(a, b)
+    return SequenceMatcher(None, a, b).get_opcodes()
+
 
 def align_words(recited_words: list, canonical_words: list) -> list:
     """
-    Align recited vs canonical using SequenceMatcher.
+    Align recited vs canonical word sequences (Indel/LCS opcodes, or SequenceMatcher fallback).
     Returns list of {"word": str, "status": str, "canonical": str|None}.
     """
     recited = " ".join(recited_words) if isinstance(recited_words, list) else recited_words
@@ -24,60 +77,167 @@ def align_words(recited_words: list, canonical_words: list) -> list:
     can_list = canonical_words if isinstance(canonical_words, list) else canonical.split()
     if not rec_list and not can_list:
         return []
-    matcher = SequenceMatcher(None, can_list, rec_list)
-    alignment = []
-    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+    alignment, extra = [], []
+    for tag, i1, i2, j1, j2 in _opcodes(can_list, rec_list):
         if tag == "equal":
-            for k in range(i2 - i1):
-                alignment.append({"word": can_list[i1 + k], "status": STATUS_CORRECT, "canonical": can_list[i1 + k]})
-        elif tag == "replace":
-            for k in range(i2 - i1):
-                alignment.append({"word": can_list[i1 + k], "status": STATUS_MISSED, "canonical": can_list[i1 + k]})
-            for k in range(j2 - j1):
-                alignment.append({"word": rec_list[j1 + k], "status": STATUS_EXTRA, "canonical": None})
-        elif tag == "delete":
-            for k in range(i2 - i1):
-                alignment.append({"word": can_list[i1 + k], "status": STATUS_MISSED, "canonical": can_list[i1 + k]})
-        elif tag == "insert":
-            for k in range(j2 - j1):
-                alignment.append({"word": rec_list[j1 + k], "status": STATUS_EXTRA, "canonical": None})
-    return alignment
+            alignment += extra
+            extra.clear()
+            alignment.extend({"word": w, "status": STATUS_CORRECT, "canonical": w} for w in can_list[i1:i2])
+            continue
+        # Each mismatched run = missed canonical words followed by extra recited words
+        if tag in ("replace", "delete"):
+            alignment.extend({"word": w, "status": STATUS_MISSED, "canonical": w} for w in can_list[i1:i2])
+        if tag in ("replace", "insert"):
+            extra.extend({"word": w, "status": STATUS_EXTRA, "canonical": None} for w in rec_list[j1:j2])
+    return alignment + extra
+
+
+def _build_tfidf(verse_tokens: list) -> dict:
+    """
+    CSR postings over verse positions: row t holds the verses containing token t
+    (verses[offsets[t]:offsets[t+1]]) with their tf * idf weights.
+    """
+    token_ids = {}
+    rows, tfs = [], []
+    for pos, tokens in enumerate(verse_tokens):
+        for token, n in Counter(tokens).items():
+            tid = token_ids.setdefault(token, len(token_ids))
+            if tid == len(rows):
+                rows.append([])
+                tfs.append([])
+            rows[tid].append(pos)
+            tfs[tid].append(n)
+    df = np.array([len(r) for r in rows], dtype=np.int64)
+    idf = (np.log(len(verse_tokens) / df) + 1).astype(np.float32)
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(df, out=offsets[1:])
+    verses = np.fromiter(chain.from_iterable(rows), dtype=np.int32, count=offsets[-1])
+    weights = np.fromiter(chain.from_iterable(tfs), dtype=np.float32, count=offsets[-1]) * np.repeat(idf, df)
+    norms = np.sqrt(np.bincount(verses, weights=weights * weights, minlength=len(verse_tokens)))
+    norms[norms == 0] = 1.0  # verses with no tokens never score
+    return {"token_ids": token_ids, "idf": idf, "offsets": offsets, "verses": verses, "weights": weights, "norms": norms}
+
+
+def _load_index():
+    """Build the token -> verse index over the whole Quran, or load it from disk."""
+    global _verse_keys, _norm_windows, _tfidf
+    if _verse_keys:
+        return
+    chapters = list_chapters()  # also ensures the Arabic XML is present
+    stamp = (_INDEX_VERSION, os.path.getmtime(ARABIC_XML_PATH))
+    try:
+        with open(VERSE_INDEX_PATH, "rb") as f:
+            data = pickle.load(f)
+        if data.get("stamp") == stamp:
+            _norm_windows, _tfidf = data["norm_windows"], data["tfidf"]
+            _verse_keys = data["verse_keys"]
+            return
+    except Exception:
+        pass  # missing or stale index: rebuild below
+    verse_keys, norm_verses, verse_tokens = [], {}, []
+    for ch in chapters:
+        cid = ch["id"]
+        for vid in range(1, 300):
+            text = get_verse(cid, vid)
+            if not text:
+                break
+            tokens = [sys.intern(t) for t in normalize_arabic(text).split()]
+            verse_tokens.append(tokens)
+            norm_verses[(cid, vid)] = " ".join(tokens)
+            verse_keys.append((cid, vid))
+    norm_windows = {}
+    for cid, vid in verse_keys:
+        texts = []
+        for k in range(MAX_WINDOW):
+            text = norm_verses.get((cid, vid + k))
+            if not text:
+                break
+            texts.append(text)
+            norm_windows[(cid, vid, k)] = " ".join(texts)
+    _norm_windows, _tfidf = norm_windows, _build_tfidf(verse_tokens)
+    _verse_keys = verse_keys
+    try:
+        with open(VERSE_INDEX_PATH, "wb") as f:
+            data = {
+                "stamp": stamp,
+                "verse_keys": _verse_keys,
+                "norm_windows": _norm_windows,
+                "tfidf": _tfidf,
+            }
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        print(f"Could not save verse index: {e}")
+
+
+def _candidate_starts(norm_words: list) -> list:
+    """Shortlist verses by TF-IDF cosine with the query; return window starts to score."""
+    token_ids, offsets = _tfidf["token_ids"], _tfidf["offsets"]
+    query = Counter(token_ids[t] for t in norm_words if t in token_ids)
+    if not query:
+        return []
+    # Sparse matrix-vector product: sum each query token's weighted postings per verse
+    rows = [slice(offsets[t], offsets[t + 1]) for t in query]
+    verses = np.concatenate([_tfidf["verses"][r] for r in rows])
+    weights = np.concatenate(
+        [_tfidf["weights"][r] * (n * _tfidf["idf"][t]) for r, (t, n) in zip(rows, query.items())]
+    )
+    scores = np.bincount(verses, weights=weights, minlength=len(_verse_keys)) / _tfidf["norms"]
+    top = np.arange(len(scores))
+    if len(scores) > SHORTLIST_SIZE:
+        top = np.argpartition(scores, -SHORTLIST_SIZE)[-SHORTLIST_SIZE:]
+    starts = set()
+    for pos in top[scores[top] > 0]:
+        cid, vid = _verse_keys[pos]
+        # Any window containing the candidate verse starts at most MAX_WINDOW - 1 verses earlier
+        starts.update((cid, v) for v in range(max(1, vid - MAX_WINDOW + 1), vid + 1))
+    return sorted(starts)
 
 
 def find_best_verse(transcription: str) -> tuple:
     """
     Find best matching verse (or verse range) for transcription.
     Supports multi-verse recitation (e.g. full An-Nas); tries 1–6 verse windows.
+    Only windows around the verses most similar to it (TF-IDF cosine) are scored,
+    unless none of them reaches FALLBACK_RATIO; then every window is scored.
     Returns (chapter_id, verse_id, end_verse_id, score).
     """
-    if not transcription or not transcription.strip():
-        return (None, None, None, 0.0)
-    norm_trans = normalize_arabic(transcription)
+    return _find_best_normalized(normalize_arabic(transcription))
+
+
+def _find_best_normalized(norm_trans: str) -> tuple:
+    """find_best_verse for an already-normalized transcription."""
     norm_words = norm_trans.split()
     if not norm_words:
         return (None, None, None, 0.0)
-    best = (None, None, None, 0.0)
-    for ch in list_chapters():
-        cid = ch["id"]
-        for vid in range(1, 300):
-            base = get_verse(cid, vid)
-            if not base:
+    _load_index()
+    best = _best_window(norm_trans, _candidate_starts(norm_words), (None, None, None, 0.0))
+    if best[3] < FALLBACK_RATIO:
+        # Misspelled words miss the token index: score every window, as a full scan would
+        best = _best_window(norm_trans, _verse_keys, best)
+    return best
+
+
+def _best_window(norm_trans: str, starts, best: tuple) -> tuple:
+    """Score 1–6 verse windows at each (chapter_id, verse_id) start; return the best so far."""
+    trans_len = len(norm_trans)
+    for cid, vid in starts:
+        # Try 1–6 verse windows (handles full surah recitation)
+        for k in range(MAX_WINDOW):
+            norm_verse = _norm_windows.get((cid, vid, k))
+            if norm_verse is None:
                 break
-            # Try 1–6 verse windows (handles full surah recitation)
-            for k in range(6):
-                end = vid + k
-                texts = [get_verse(cid, v) for v in range(vid, end + 1)]
-                if not all(text for text in texts):
-                    break
-                combined = " ".join(texts)
-                norm_verse = normalize_arabic(combined)
-                if not norm_verse:
-                    continue
-                ratio = SequenceMatcher(None, norm_verse, norm_trans).ratio()
-                if ratio > best[3]:
-                    best = (cid, vid, end, ratio)
-                    if ratio > 0.95:
-                        return best  # Near-perfect match, no need to search further
+            # Length-only upper bound on the ratio: 2 * min(len) / (sum of lens)
+            verse_len = len(norm_verse)
+            if 2 * min(verse_len, trans_len) / (verse_len + trans_len) <= best[3]:
+                if verse_len > trans_len:
+                    break  # longer windows only lower the bound
+                continue
+            end = vid + k
+            ratio = _ratio(norm_verse, norm_trans)
+            if ratio > best[3]:
+                best = (cid, vid, end, ratio)
+                if ratio > 0.95:
+                    return best  # Near-perfect match, no need to search further
     return best
 
 
@@ -85,15 +245,22 @@ def match_and_analyze(transcription: str) -> dict:
     """
     Match transcription to verse, compute alignment and accuracy.
     Returns {matched_verse, chapter_id, verse_id, accuracy_pct, word_alignment}.
+    Results are cached by normalized transcription, so treat them as read-only.
     """
-    cid, vid, end_vid, score = find_best_verse(transcription)
+    return _match_normalized(normalize_arabic(transcription))
+
+
+@lru_cache(maxsize=512)
+def _match_normalized(norm_trans: str) -> dict:
+    """match_and_analyze for an already-normalized transcription (repeat recitations hit the cache)."""
+    cid, vid, end_vid, score = _find_best_normalized(norm_trans)
     if cid is None:
         return {"matched_verse": "", "chapter_id": None, "verse_id": None, "accuracy_pct": 0, "word_alignment": []}
     # Build canonical from verse range
     end_vid = end_vid if end_vid is not None else vid
     canonical = " ".join(get_verse(cid, v) for v in range(vid, end_vid + 1))
-    rec_list = normalize_arabic(transcription).split()
-    can_list = normalize_arabic(canonical).split()
+    rec_list = norm_trans.split()
+    can_list = _norm_windows[(cid, vid, end_vid - vid)].split()
     alignment = align_words(rec_list, can_list)
     correct = sum(1 for a in alignment if a["status"] == STATUS_CORRECT)
     total = len(can_list)  # accuracy = correct / canonical words
@@ -110,18 +277,9 @@ def match_and_analyze(transcription: str) -> dict:
 
 def render_alignment_html(alignment: list, rtl: bool = True) -> str:
     """Render word alignment as HTML with Tarteel-style colors. RTL for Arabic."""
-    colors = {
-        STATUS_CORRECT: "#22c55e",   # green
-        STATUS_MISSED: "#ef4444",    # red
-        STATUS_INCORRECT: "#ef4444", # red
-        STATUS_EXTRA: "#f59e0b",     # amber
-    }
-    parts = []
-    for a in alignment:
-        c = colors.get(a["status"], "#6b7280")
-        w = a["word"].replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-        parts.append(f'<span style="color:{c};font-weight:bold;">{w}</span>')
-    inner = " ".join(parts)
+    inner = " ".join(
+        _SPAN(_STATUS_COLORS.get(a["status"], "#6b7280"), escape(a["word"], quote=False)) for a in alignment
+    )
     if rtl:
         return f'<div dir="rtl" style="text-align: right;">{inner}</div>'
     return inner
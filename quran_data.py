@@ -2,70 +2,166 @@
 Quran data: XML parser (Tanzil), Quran Enc API (East African translations).
 """
 
+import asyncio
+import json
 import os
+import pickle
 import re
+import sqlite3
+import sys
+import time
 import unicodedata
 import xml.etree.ElementTree as ET
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+from functools import lru_cache
 from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+except ImportError:  # optional, falls back to the requests thread pool
+    httpx = None
 
 from config import (
     ARABIC_XML_PATH,
     DATA_DIR,
     QURANENC_BASE,
+    QURANENC_CACHE_TTL_DAYS,
+    QURANENC_DB_PATH,
     QURANENC_TRANSLATIONS,
+    QURAN_SNAPSHOT_PATH,
     ARABIC_XML_URL,
 )
 
 
+# Sura fetches in flight per language; the pooled session keeps their connections alive
+_FETCH_WORKERS = 16
+# Shared by every HTTP call here; retries transient failures with exponential backoff
+_RETRY = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+_SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(
+    max_retries=_RETRY, pool_connections=4, pool_maxsize=_FETCH_WORKERS * len(QURANENC_TRANSLATIONS)
+)
+_SESSION.mount("https://", _ADAPTER)
+_SESSION.mount("http://", _ADAPTER)
+
+
 def ensure_arabic_xml():
     """Download Arabic XML if not present. Handle BOM if present."""
     os.makedirs(DATA_DIR, exist_ok=True)
     if not os.path.exists(ARABIC_XML_PATH):
         print("Downloading Arabic Quran XML...")
-        r = requests.get(ARABIC_XML_URL, timeout=30)
-        r.raise_for_status()
-        content = r.content.decode("utf-8-sig")  # strips BOM if present
-        with open(ARABIC_XML_PATH, "w", encoding="utf-8") as f:
-            f.write(content)
+        tmp = ARABIC_XML_PATH + ".part"
+        with _SESSION.get(ARABIC_XML_URL, stream=True, timeout=30) as r, open(tmp, "wb") as f:
+            r.raise_for_status()
+            first = True
+            for chunk in r.iter_content(65536):
+                if first and chunk:
+                    chunk = chunk.removeprefix(b"\xef\xbb\xbf")  # strip BOM if present
+                    first = False
+                f.write(chunk)
+        os.replace(tmp, ARABIC_XML_PATH)  # atomic: no half-written XML on interrupt
         print("Downloaded.")
 
 
+class _TashkeelTable(dict):
+    """
+    str.translate table equal to NFD -> drop combining marks (Mn) -> NFC, per code point:
+    marks map to None, letters carrying a mark (e.g. أ, آ) map to their base letter.
+    Entries are derived on first sight and memoized, including identity entries, so
+    every later lookup is a plain dict hit and no table is built at import.
+    """
+
+    def __missing__(self, cp):
+        c = chr(cp)
+        if unicodedata.category(c) == "Mn":
+            value = None
+        else:
+            base = "".join(d for d in unicodedata.normalize("NFD", c) if unicodedata.category(d) != "Mn")
+            base = unicodedata.normalize("NFC", base)
+            value = base if base != c else cp
+        self[cp] = value
+        return value
+
+
+_TASHKEEL_TABLE = _TashkeelTable()
+
+
+@lru_cache(maxsize=4096)
 def normalize_arabic(text: str) -> str:
     """Strip tashkeel (diacritics) and normalize whitespace for matching."""
     if not text:
         return ""
-    try:
-        from pyarabic import strip_tashkeel
-        stripped = strip_tashkeel(text)
-    except ImportError:
-        nfd = unicodedata.normalize("NFD", text)
-        stripped = "".join(c for c in nfd if unicodedata.category(c) != "Mn")
-        stripped = unicodedata.normalize("NFC", stripped)
-    return " ".join(stripped.split())
+    return " ".join(text.translate(_TASHKEEL_TABLE).split())
 
 
 # --- Tanzil XML ---
-_arabic_tree = None
 _arabic_verses = {}  # (chapter_id, verse_id) -> text
+_chapter_names = {}  # chapter_id -> name, in XML order
+_verses_by_chapter = {}  # chapter_id -> {verse_id: text}
+_normalized_verses = []  # [(chapter_id, verse_id, normalized text)] for search_verses
+_chapters_list = ()  # ({id, name}, ...) in XML order, built on first list_chapters call
+_search_blob = None  # built on first search_verses call, see _search_index
+_search_starts = []
+_SNAPSHOT_VERSION = 1  # bump when the snapshot layout or normalize_arabic changes
 
 
 def _load_arabic():
-    global _arabic_tree, _arabic_verses
-    if _arabic_tree is not None:
+    """
+    Load the Tanzil XML once: from the pickled snapshot when it matches the XML,
+    else stream-parse it, clearing each element after use (no tree kept).
+    """
+    global _arabic_verses, _chapter_names, _verses_by_chapter, _normalized_verses
+    if _arabic_verses:
         return
     ensure_arabic_xml()
-    _arabic_tree = ET.parse(ARABIC_XML_PATH)
-    root = _arabic_tree.getroot()
-    ns = {}  # Tanzil has no namespace in this file
-    for chapter in root.findall("Chapter"):
-        cid = int(chapter.get("ChapterID", 0))
-        for verse in chapter.findall("Verse"):
-            vid = int(verse.get("VerseID", 0))
-            text = (verse.text or "").strip()
-            _arabic_verses[(cid, vid)] = text
-    return
+    stamp = (_SNAPSHOT_VERSION, os.path.getmtime(ARABIC_XML_PATH))
+    try:
+        with open(QURAN_SNAPSHOT_PATH, "rb") as f:
+            data = pickle.load(f)
+        if data.get("stamp") == stamp:
+            _chapter_names, _verses_by_chapter = data["chapter_names"], data["verses_by_chapter"]
+            _normalized_verses = data["normalized_verses"]
+            _arabic_verses = data["verses"]
+            return
+    except Exception:
+        pass  # missing or stale snapshot: parse the XML below
+    verses, names, by_chapter = {}, {}, {}
+    cid = 0
+    for event, elem in ET.iterparse(ARABIC_XML_PATH, events=("start", "end")):
+        if event == "start":
+            if elem.tag == "Chapter":  # attributes are available on start
+                cid = int(elem.get("ChapterID", 0))
+                names[cid] = elem.get("ChapterName", "")
+                by_chapter.setdefault(cid, {})
+            continue
+        if elem.tag == "Verse":
+            vid = int(elem.get("VerseID", 0))
+            # Interned: repeated verses (e.g. the refrain of Ar-Rahman) share one str
+            verses[(cid, vid)] = by_chapter[cid][vid] = sys.intern((elem.text or "").strip())
+            elem.clear()
+        elif elem.tag == "Chapter":
+            elem.clear()
+    _normalized_verses = [(c, v, sys.intern(normalize_arabic(text))) for (c, v), text in verses.items()]
+    _chapter_names, _verses_by_chapter = names, by_chapter
+    _arabic_verses = verses  # set last: marks the data as loaded
+    try:
+        with open(QURAN_SNAPSHOT_PATH, "wb") as f:
+            data = {
+                "stamp": stamp,
+                "verses": _arabic_verses,
+                "chapter_names": _chapter_names,
+                "verses_by_chapter": _verses_by_chapter,
+                "normalized_verses": _normalized_verses,
+            }
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        print(f"Could not save Quran snapshot: {e}")
 
 
 def get_verse(chapter_id: int, verse_id: int) -> str:
@@ -77,22 +173,31 @@ def get_verse(chapter_id: int, verse_id: int) -> str:
 def get_chapter(chapter_id: int) -> dict:
     """Return chapter info: {id, name, verses}."""
     _load_arabic()
-    verses = {vid: text for (cid, vid), text in _arabic_verses.items() if cid == chapter_id}
-    root = _arabic_tree.getroot()
-    for ch in root.findall("Chapter"):
-        if int(ch.get("ChapterID", 0)) == chapter_id:
-            return {"id": chapter_id, "name": ch.get("ChapterName", ""), "verses": verses}
-    return {"id": chapter_id, "name": "", "verses": {}}
+    if chapter_id not in _chapter_names:
+        return {"id": chapter_id, "name": "", "verses": {}}
+    return {"id": chapter_id, "name": _chapter_names[chapter_id], "verses": dict(_verses_by_chapter[chapter_id])}
 
 
 def list_chapters() -> list:
-    """Return list of {id, name} for all 114 chapters."""
-    _load_arabic()
-    root = _arabic_tree.getroot()
-    return [
-        {"id": int(ch.get("ChapterID", 0)), "name": ch.get("ChapterName", "")}
-        for ch in root.findall("Chapter")
-    ]
+    """Return list of {id, name} for all 114 chapters (the dicts are shared: read-only)."""
+    global _chapters_list
+    if not _chapters_list:
+        _load_arabic()
+        _chapters_list = tuple({"id": cid, "name": name} for cid, name in _chapter_names.items())
+    return list(_chapters_list)
+
+
+def _search_index():
+    """All normalized verses joined on \\x1f (whitespace, so never in a normalized query), plus verse start offsets."""
+    global _search_blob, _search_starts
+    if _search_blob is None:
+        starts, pos = [], 0
+        for _, _, text in _normalized_verses:
+            starts.append(pos)
+            pos += len(text) + 1
+        _search_starts = starts
+        _search_blob = "\x1f".join(text for _, _, text in _normalized_verses)
+    return _search_blob, _search_starts
 
 
 def search_verses(query: str) -> list:
@@ -101,11 +206,16 @@ def search_verses(query: str) -> list:
     norm_query = normalize_arabic(query)
     if not norm_query:
         return []
-    results = []
-    for (cid, vid), text in _arabic_verses.items():
-        if norm_query in normalize_arabic(text):
-            results.append((cid, vid))
-    return results
+    blob, starts = _search_index()
+    hits = []
+    pos = blob.find(norm_query)
+    while pos != -1:
+        i = bisect_right(starts, pos) - 1
+        hits.append(_normalized_verses[i][:2])
+        if i + 1 == len(starts):
+            break
+        pos = blob.find(norm_query, starts[i + 1])  # next verse: one hit per verse
+    return hits
 
 
 # --- Tanzil English (optional, simplified) ---
@@ -115,83 +225,210 @@ def search_verses(query: str) -> list:
 # --- Quran Enc API (Somali, Amharic, Swahili) ---
 _quranenc_cache = {}  # lang -> {(sura, aya): translation}
 
-# Quran Enc returns "7. Translation text..." - strip leading verse numbers
-_RE_VERSE_NUM = re.compile(r"^\d+\.\s*")
-# Footnote refs like [1], [4], [10] in translation text
-_RE_FOOTNOTE = re.compile(r"\[\d+\]")
+# Quran Enc returns "7. Translation text..." with footnote refs like [1], [4], [10]:
+# strip the leading verse number and the refs in one pass
+_RE_CLEAN = re.compile(r"^\d+\.\s*|\[\d+\]")
 
 
 def _clean_quranenc_translation(text: str) -> str:
     """Remove leading verse numbers (e.g. 7.) and footnote refs (e.g. [4]) from Quran Enc API text."""
     if not text:
         return text
-    t = _RE_VERSE_NUM.sub("", text).strip()
-    t = _RE_FOOTNOTE.sub("", t)
-    return " ".join(t.split())  # normalize spaces
+    if text[:1].isdigit() or "[" in text:
+        text = _RE_CLEAN.sub("", text)
+    return " ".join(text.split())  # normalize spaces
+
+
+def _connect_store():
+    os.makedirs(DATA_DIR, exist_ok=True)
+    conn = sqlite3.connect(QURANENC_DB_PATH, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS translations ("
+        "key TEXT, sura INTEGER, aya INTEGER, text TEXT, fetched REAL, PRIMARY KEY (key, sura, aya))"
+    )
+    return conn
+
+
+def _read_stored(key: str, sura: int = None) -> tuple:
+    """
+    Read stored translations for a Quran Enc key, optionally one sura, from disk.
+    Returns ({(sura, aya): translation}, stale suras). Rows older than the TTL are
+    still returned: callers refetch those suras but keep the rows if that fails.
+    """
+    since = time.time() - QURANENC_CACHE_TTL_DAYS * 86400
+    query = "SELECT sura, aya, text, fetched FROM translations WHERE key = ?"
+    params = (key,)
+    if sura is not None:
+        query += " AND sura = ?"
+        params += (sura,)
+    rows, stale = {}, set()
+    try:
+        with closing(_connect_store()) as conn:
+            for s, a, text, fetched in conn.execute(query, params):
+                rows[(s, a)] = text
+                if fetched < since:
+                    stale.add(s)
+    except sqlite3.Error as e:
+        print(f"Quran Enc cache read error ({key}): {e}")
+        return {}, set()
+    return rows, stale
+
+
+def _store(key: str, rows: dict):
+    """Write-through: persist fetched {(sura, aya): translation} rows in one transaction."""
+    if not rows:
+        return
+    now = time.time()
+    try:
+        with closing(_connect_store()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?)",
+                [(key, s, a, text, now) for (s, a), text in rows.items()],
+            )
+    except sqlite3.Error as e:
+        print(f"Quran Enc cache write error ({key}): {e}")
+
+
+def _parse_sura(content: bytes, sura: int) -> dict:
+    """Parse a Quran Enc sura response body into {(sura, aya): translation}."""
+    data = json.loads(content)
+    result = {}
+    for item in data.get("result", []):
+        s = int(item.get("sura", sura))
+        a = int(item.get("aya", 0))
+        result[(s, a)] = _clean_quranenc_translation(item.get("translation") or "")
+    return result
+
+
+def _fetch_sura(base: str, sura: int, timeout: float) -> dict:
+    """Fetch one sura from Quran Enc. Returns {(sura, aya): translation}; raises on failure."""
+    r = _SESSION.get(f"{base}/{sura}", timeout=timeout)
+    r.raise_for_status()
+    return _parse_sura(r.content, sura)
+
+
+async def _fetch_suras_async(base: str, suras: list, timeout: float) -> dict:
+    """
+    Fetch suras concurrently over one httpx client, multiplexed on HTTP/2 when h2 is
+    installed. At most _FETCH_WORKERS requests are in flight, so queued ones never wait
+    on the pool. JSON parsing runs in the default executor so the loop keeps reading.
+    Returns {sura: rows or the exception raised}.
+    """
+    loop = asyncio.get_running_loop()
+    limits = httpx.Limits(max_connections=_FETCH_WORKERS)
+    timeouts = httpx.Timeout(timeout, pool=None)  # the semaphore bounds waiting, not the pool
+    try:
+        client = httpx.AsyncClient(http2=True, limits=limits, timeout=timeouts)
+    except ImportError:  # h2 not installed: HTTP/1.1 keep-alive pool
+        client = httpx.AsyncClient(limits=limits, timeout=timeouts)
+    slots = asyncio.Semaphore(_FETCH_WORKERS)
+
+    async def fetch(sura):
+        async with slots:
+            r = await client.get(f"{base}/{sura}")
+        r.raise_for_status()
+        return await loop.run_in_executor(None, _parse_sura, r.content, sura)
+
+    async with client:
+        results = await asyncio.gather(*(fetch(sura) for sura in suras), return_exceptions=True)
+    return dict(zip(suras, results))
+
+
+def _fetch_threaded(base: str, suras: list, timeout: float):
+    """Yield (sura, rows or exception) as each sura arrives over the pooled session, on a thread pool."""
+    with ThreadPoolExecutor(max_workers=_FETCH_WORKERS) as ex:
+        futures = {ex.submit(_fetch_sura, base, sura, timeout): sura for sura in suras}
+        for fut in as_completed(futures):
+            try:
+                rows = fut.result()
+            except Exception as e:
+                rows = e
+            yield futures[fut], rows
+
+
+def _fetch_missing(base: str, suras: list, timeout: float):
+    """
+    Yield (sura, rows or exception) for each sura: over httpx when it is installed and
+    no event loop runs in this thread, else over the pooled session on a thread pool.
+    """
+    if not suras:
+        return
+    try:
+        asyncio.get_running_loop()
+        use_async = False  # asyncio.run() cannot nest inside a running loop
+    except RuntimeError:
+        use_async = httpx is not None
+    if not use_async:
+        yield from _fetch_threaded(base, suras, timeout)
+        return
+    retry = []
+    for sura, rows in asyncio.run(_fetch_suras_async(base, suras, timeout)).items():
+        if isinstance(rows, Exception):
+            retry.append(sura)
+        else:
+            yield sura, rows
+    # httpx does not retry on status: failed suras get the session's Retry backoff, concurrently
+    yield from _fetch_threaded(base, retry, timeout)
 
 
 def load_quranenc_translation(lang: str) -> bool:
-    """Fetch all 114 suras from Quran Enc API, cache in memory. Returns True on success."""
-    if lang not in QURANENC_TRANSLATIONS:
+    """
+    Load all 114 suras into memory: from the on-disk cache, fetching only missing or
+    stale suras from Quran Enc API (concurrently). A stale sura whose refetch fails
+    keeps its cached rows. Returns True on success.
+    """
+    key = QURANENC_TRANSLATIONS.get(lang)
+    if key is None:
         return False
     if lang in _quranenc_cache:
         return True
-    key = QURANENC_TRANSLATIONS[lang]
-    cache = {}
+    cache, stale = _read_stored(key)
+    stored_suras = {s for s, _ in cache}
+    missing = [sura for sura in range(1, 115) if sura not in stored_suras or sura in stale]
     base = f"{QURANENC_BASE}/{key}"
-    for sura in range(1, 115):
-        try:
-            r = requests.get(f"{base}/{sura}", timeout=15)
-            r.raise_for_status()
-            data = r.json()
-            for item in data.get("result", []):
-                s = int(item.get("sura", sura))
-                a = int(item.get("aya", 0))
-                trans = _clean_quranenc_translation(item.get("translation") or "")
-                cache[(s, a)] = trans
-        except Exception as e:
-            print(f"Quran Enc fetch error (sura {sura}, {lang}): {e}")
+    for sura, rows in _fetch_missing(base, missing, 15):
+        if isinstance(rows, Exception):
+            print(f"Quran Enc fetch error (sura {sura}, {lang}): {rows}")
+            continue
+        cache.update(rows)
+        _store(key, rows)
     _quranenc_cache[lang] = cache
     return True
 
 
-def load_quranenc_sura(lang: str, sura: int, retries: int = 2) -> bool:
-    """Lazy load: fetch one sura only. Retries on failure."""
-    if lang not in QURANENC_TRANSLATIONS:
+def load_quranenc_sura(lang: str, sura: int) -> bool:
+    """
+    Lazy load: one sura only, from the on-disk cache or Quran Enc API (the session retries
+    failures). A stale cached sura is refetched, but kept if the refetch fails.
+    """
+    key = QURANENC_TRANSLATIONS.get(lang)
+    if key is None:
         return False
-    if lang not in _quranenc_cache:
-        _quranenc_cache[lang] = {}
-    cache = _quranenc_cache[lang]
-    key = QURANENC_TRANSLATIONS[lang]
-    url = f"{QURANENC_BASE}/{key}/{sura}"
-    for attempt in range(retries + 1):
-        try:
-            r = requests.get(url, timeout=20)
-            r.raise_for_status()
-            data = r.json()
-            for item in data.get("result", []):
-                s = int(item.get("sura", sura))
-                a = int(item.get("aya", 0))
-                trans = _clean_quranenc_translation(item.get("translation") or "")
-                cache[(s, a)] = trans
-            return True
-        except Exception as e:
-            if attempt < retries:
-                continue
-            print(f"Quran Enc fetch error (sura {sura}, {lang}): {e}")
-            return False
-    return False
+    cache = _quranenc_cache.setdefault(lang, {})
+    stored, stale = _read_stored(key, sura)
+    cache.update(stored)
+    if stored and not stale:
+        return True
+    base = f"{QURANENC_BASE}/{key}"
+    try:
+        rows = _fetch_sura(base, sura, 20)
+    except Exception as e:
+        print(f"Quran Enc fetch error (sura {sura}, {lang}): {e}")
+        return bool(stored)
+    cache.update(rows)
+    _store(key, rows)
+    return True
+
+
+# Lowercase language keys and display names ('somali', 'Somali' -> 'somali') -> API keys
+_LANG_ALIAS = {alias: key for key in QURANENC_TRANSLATIONS for alias in (key, key.replace("_", " "))}
 
 
 def _normalize_trans_lang(lang: str) -> str:
     """Map display names ('Somali') to API keys ('somali')."""
     if not lang:
         return lang
-    low = lang.strip().lower()
-    for key in QURANENC_TRANSLATIONS:
-        if key == low or key.replace("_", " ") == low:
-            return key
-    return lang
+    return _LANG_ALIAS.get(lang.strip().lower(), lang)
 
 
 def get_translation(chapter_id: int, verse_id: int, lang: str) -> str:
@@ -204,11 +441,11 @@ def get_translation(chapter_id: int, verse_id: int, lang: str) -> str:
     if lang == "ar":
         return get_verse(chapter_id, verse_id)
     lang = _normalize_trans_lang(lang)
-    if lang in QURANENC_TRANSLATIONS:
-        cache = _quranenc_cache.get(lang, {})
-        key = (chapter_id, verse_id)
-        if key not in cache:
-            load_quranenc_sura(lang, chapter_id)
-            cache = _quranenc_cache.get(lang, {})
-        return cache.get(key, "")
-    return ""
+    if lang not in QURANENC_TRANSLATIONS:
+        return ""
+    key = (chapter_id, verse_id)
+    text = _quranenc_cache.get(lang, {}).get(key)
+    if text is None:
+        load_quranenc_sura(lang, chapter_id)
+        text = _quranenc_cache.get(lang, {}).get(key, "")
+    return text
@@ -4,38 +4,59 @@ Transcribe Quranic Arabic audio. Verse matching, export to TXT/JSON/SRT.
 """
 
 import argparse
+import io
 import json
 import os
 
-from asr_engine import get_device, transcribe as asr_transcribe
+try:
+    import orjson
+except ImportError:  # optional, falls back to json
+    orjson = None
+
+from asr_engine import get_device
+from asr_engine import transcribe as asr_transcribe
+from asr_engine import transcribe_batch as asr_transcribe_batch
 from config import DEFAULT_ASR_MODEL
 from matcher import match_and_analyze
 
 
 def main():
     parser = argparse.ArgumentParser(description="Transcribe Quran audio with Whisper")
-    parser.add_argument("audio_path", nargs="?", help="Path to audio file")
+    parser.add_argument("audio_paths", nargs="*", metavar="audio_path", help="Audio file(s); several run batched")
     parser.add_argument("--device", choices=["auto", "mps", "cpu"], default="auto", help="Device")
     parser.add_argument("--match", action="store_true", help="Run verse matcher, print Surah:Ayah + accuracy")
     parser.add_argument("--export", choices=["txt", "json", "srt"], help="Export format")
     parser.add_argument("--timestamps", action="store_true", help="Include timestamps")
     args = parser.parse_args()
 
-    if not args.audio_path or not os.path.isfile(args.audio_path):
+    if not args.audio_paths or not all(os.path.isfile(p) for p in args.audio_paths):
         parser.error("Provide a valid audio file path")
 
     print(f"Using device: {get_device()}")
-    print(f"Transcribing: {args.audio_path}")
 
-    result = asr_transcribe(args.audio_path, model_id=DEFAULT_ASR_MODEL, return_timestamps=args.timestamps)
-    text = result["text"]
-    chunks = result.get("chunks", [])
+    if len(args.audio_paths) == 1:
+        audio_path = args.audio_paths[0]
+        print(f"Transcribing: {audio_path}")
+        result = asr_transcribe(audio_path, model_id=DEFAULT_ASR_MODEL, return_timestamps=args.timestamps)
+        _report(audio_path, result["text"], result.get("chunks", []), args)
+        return
+
+    print(f"Transcribing {len(args.audio_paths)} files in batches")
+    for result in asr_transcribe_batch(args.audio_paths, model_id=DEFAULT_ASR_MODEL):
+        print(f"\n=== {result['path']} ===")
+        if "error" in result:
+            print(f"Error: {result['error']}")
+            continue
+        _report(result["path"], result["text"], result["chunks"], args)
 
+
+def _report(audio_path, text, chunks, args):
+    """Print one file's transcription (and verse match), then export it next to the audio."""
     print("\n--- Transcription ---")
     print(text)
 
-    if args.match:
-        analysis = match_and_analyze(text)
+    analysis = match_and_analyze(text) if args.match else None
+    if analysis is not None:
         if analysis["chapter_id"]:
             print(f"\n--- Match ---")
             vid_end = analysis.get("verse_id_end", analysis["verse_id"])
@@ -45,7 +66,7 @@ def main():
             print("\n--- Match ---\nNo verse match found.")
 
     if args.export:
-        base = os.path.splitext(args.audio_path)[0]
+        base = os.path.splitext(audio_path)[0]
         if args.export == "txt":
             path = base + ".txt"
             with open(path, "w", encoding="utf-8") as f:
@@ -54,30 +75,36 @@ def main():
         elif args.export == "json":
             path = base + ".json"
             data = {"text": text, "chunks": chunks}
-            if args.match:
-                data["match"] = match_and_analyze(text)
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            if analysis is not None:
+                data["match"] = analysis
+            if orjson is not None:
+                with open(path, "wb") as f:
+                    f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+            else:
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
             print(f"\nExported: {path}")
         elif args.export == "srt":
             path = base + ".srt"
-            lines = []
+            buf = io.StringIO()
             for i, c in enumerate(chunks, 1):
                 ts = c.get("timestamp", (0, 0))
                 start = _ts_to_srt(ts[0])
                 end = _ts_to_srt(ts[1]) if len(ts) > 1 else start
-                lines.append(f"{i}\n{start} --> {end}\n{c.get('text','')}\n")
+                if i > 1:
+                    buf.write("\n")
+                buf.write(f"{i}\n{start} --> {end}\n{c.get('text','')}\n")
             with open(path, "w", encoding="utf-8") as f:
-                f.write("\n".join(lines))
+                f.write(buf.getvalue())
             print(f"\nExported: {path}")
 
 
 def _ts_to_srt(sec):
     if isinstance(sec, (int, float)):
-        h = int(sec // 3600)
-        m = int((sec % 3600) // 60)
-        s = sec % 60
-        return f"{h:02d}:{m:02d}:{s:06.3f}".replace(".", ",")
+        s, ms = divmod(int(round(sec * 1000)), 1000)
+        m, s = divmod(s, 60)
+        h, m = divmod(m, 60)
+        return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
     return "00:00:00,000"
 
 